@@ -1,6 +1,15 @@
 import os
+import numpy as np
 import pandas as pd
 import plotly.express as px
+
+try:
+    # Use Intel's accelerated KMeans when scikit-learn-intelex is installed
+    from sklearnex import patch_sklearn
+    patch_sklearn()
+except ImportError:
+    pass
+
 from sklearn.cluster import KMeans
 from datetime import datetime
 
@@ -8,13 +17,16 @@ from datetime import datetime
 DATA_FOLDER = "data/cleaned_data"
 OUTPUT_FOLDER = "data/processed_data"
 
+# Largest number of customers drawn in the 3D cluster plot
+MAX_PLOT_POINTS = 100_000
+
 # Ensure the output folder exists
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
 def load_data(file_name):
     """ Load the cleaned RFM dataset """
     file_path = os.path.join(DATA_FOLDER, file_name)
-    df = pd.read_csv(file_path)
+    df = pd.read_parquet(file_path)
     print(f"✅ Loaded {file_name} with {df.shape[0]} rows and {df.shape[1]} columns")
     return df
 
@@ -24,58 +36,99 @@ def save_data(df, file_name):
     df.to_csv(output_path, index=False)
     print(f"💾 Saved processed data: {output_path}")
 
+def aggregate_rfm_sorted(df, reference_day):
+    """ Compute RFM metrics with one argsort and numpy reduceat (non-null integer CustomerID only) """
+    customer_ids = df['CustomerID'].to_numpy()
+    order = np.argsort(customer_ids, kind='stable')
+    customer_ids = customer_ids[order]
+    sales_days = df['SalesDay'].to_numpy(dtype=np.float64, na_value=np.nan)[order]
+    total_price = df['TotalPrice'].to_numpy(dtype=np.float64, na_value=np.nan)[order]
+
+    # Start offset of each customer's run of rows in the sorted arrays
+    uniques, starts = np.unique(customer_ids, return_index=True)
+
+    # Missing values are skipped, matching the pandas groupby reductions
+    recency = reference_day - np.fmax.reduceat(sales_days, starts)
+    frequency = np.add.reduceat(~np.isnan(sales_days), starts)
+    monetary = np.add.reduceat(np.nan_to_num(total_price), starts)
+
+    if not np.isnan(recency).any():
+        recency = recency.astype(np.int32)
+
+    return pd.DataFrame(
+        {'Recency': recency, 'Frequency': frequency, 'Monetary': monetary},
+        index=pd.Index(uniques, name='CustomerID'),
+    )
+
 def calculate_rfm(df):
     """ Compute RFM (Recency, Frequency, Monetary) metrics """
-    df['SalesDate'] = pd.to_datetime(df['SalesDate'])
+    # SalesDay holds int32 days since 1970-01-01; the reference day is the most recent transaction
+    reference_day = df['SalesDay'].max()
 
-    # Define the reference date (most recent transaction in dataset)
-    reference_date = df['SalesDate'].max()
+    # Sales without a customer cannot be segmented (groupby drops them too)
+    df = df[df['CustomerID'].notna()]
 
     # Compute RFM metrics
-    rfm = df.groupby('CustomerID').agg({
-        'SalesDate': [  # Recency & Frequency
-            lambda x: (reference_date - x.max()).days,  # Recency
-            'count'  # Frequency (number of transactions)
-        ],
-        'TotalPrice': 'sum'  # Monetary
-    })
-
-    # Fix: Properly rename the multi-index columns
-    rfm.columns = ['Recency', 'Frequency', 'Monetary']
-
-    print("\n📊 Checking available columns in RFM DataFrame before clustering:", rfm.columns)
+    if pd.api.types.is_integer_dtype(df['CustomerID']):
+        rfm = aggregate_rfm_sorted(df, reference_day)
+    else:
+        # Non-integer CustomerIDs: fall back to groupby
+        g = df.groupby('CustomerID')
+        rfm = pd.DataFrame({
+            'Recency': reference_day - g['SalesDay'].max(),
+            'Frequency': g['SalesDay'].count(),  # number of dated transactions
+            'Monetary': g['TotalPrice'].sum(),
+        })
+
+    if __debug__:  # Stripped under python -O
+        print("\n📊 Checking available columns in RFM DataFrame before clustering:", rfm.columns)
     print("\n✅ RFM metrics calculated successfully!\n")
     return rfm
 
 def cluster_customers(rfm, n_clusters=4):
     """ Apply K-Means Clustering to segment customers """
-    # Normalize data (scale between 0-1)
-    rfm_scaled = (rfm - rfm.min()) / (rfm.max() - rfm.min())
+    # Normalize data (scale between 0-1) in place on a private C-ordered float32 copy,
+    # the layout KMeans validates against, so it can use X with copy_x=False
+    X = np.array(rfm[['Recency', 'Frequency', 'Monetary']], dtype=np.float32, order='C')
+    X -= X.min(axis=0)
+    value_range = X.max(axis=0)
+    value_range[value_range == 0] = 1  # constant columns stay at 0
+    X /= value_range
 
     # Apply K-Means clustering
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-    rfm['Cluster'] = kmeans.fit_predict(rfm_scaled)
+    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10, copy_x=False)
+    rfm['Cluster'] = kmeans.fit_predict(X).astype(np.min_scalar_type(n_clusters - 1))  # smallest dtype holding every label
 
     print("\n✅ Customers segmented into clusters successfully!\n")
     return rfm
 
 def visualize_clusters(rfm):
     """ Create an interactive 3D scatter plot for customer segmentation """
-    print("\n📊 Checking available columns in RFM DataFrame before visualization:", rfm.columns)
+    if __debug__:  # Stripped under python -O
+        print("\n📊 Checking available columns in RFM DataFrame before visualization:", rfm.columns)
+
+    # Plot a random sample of very large segmentations; the HTML embeds every point
+    if len(rfm) > MAX_PLOT_POINTS:
+        print(f"📉 Plotting a sample of {MAX_PLOT_POINTS} of {len(rfm)} customers")
+        rfm = rfm.sample(MAX_PLOT_POINTS, random_state=42)
 
     fig = px.scatter_3d(rfm, x='Recency', y='Frequency', z='Monetary',
                         color='Cluster', title="Customer Segmentation (RFM Analysis)",
                         hover_data=['Recency', 'Frequency', 'Monetary'])
 
-    fig.show()
-    fig.write_html(os.path.join(OUTPUT_FOLDER, "rfm_clusters.html"))
+    # Only open a browser when running interactively (INTERACTIVE=1)
+    if os.environ.get('INTERACTIVE'):
+        fig.show()
+    fig.write_html(os.path.join(OUTPUT_FOLDER, "rfm_clusters.html"), include_plotlyjs='cdn', full_html=False)
     print("📊 Interactive visualization saved as 'rfm_clusters.html'")
 
-def main():
+def main(df=None):
+    """ Run customer segmentation on the cleaned RFM rows, loading them from disk if not given """
     print("\n🚀 Starting Customer Segmentation (RFM Analysis)...\n")
 
     # Step 1: Load Data
-    df = load_data("cleaned_rfm_analysis.csv")
+    if df is None:
+        df = load_data("cleaned_rfm_analysis.parquet")
 
     # Step 2: Calculate RFM Metrics
     rfm = calculate_rfm(df)
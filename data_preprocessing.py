@@ -1,21 +1,78 @@
 import os
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+import customer_segmentation
 
 # Define data folder paths
 DATA_FOLDER = "data"
 OUTPUT_FOLDER = os.path.join(DATA_FOLDER, "cleaned_data")
 
+# Tokens treated as missing values in the raw CSVs
+NULL_VALUES = ['NULL', 'NA', 'N/A', 'NaN', '']
+
+# Explicit pyarrow types for the columns each raw CSV is read with, so no column is
+# type-inferred (the streaming reader would otherwise infer from the first block only).
+# Join keys are int32 in every table so sales chunks and dimensions share one key type.
+SCHEMAS = {
+    'sales.csv': {
+        'SalesID': pa.int32(), 'SalesPersonID': pa.int32(), 'CustomerID': pa.int32(), 'ProductID': pa.int32(),
+        'Quantity': pa.int16(), 'Discount': pa.float32(), 'TotalPrice': pa.float64(), 'SalesDate': pa.timestamp('ms'),
+    },
+    'products.csv': {'ProductID': pa.int32(), 'Price': pa.float64(), 'CategoryID': pa.int32()},
+    'customers.csv': {'CustomerID': pa.int32(), 'CityID': pa.int32()},
+    'cities.csv': {'CityID': pa.int32(), 'CountryID': pa.int32(), 'CityName': pa.string()},
+    'countries.csv': {'CountryID': pa.int32(), 'CountryName': pa.string()},
+    'categories.csv': {'CategoryID': pa.int32(), 'CategoryName': pa.string()},
+    'employees.csv': {'EmployeeID': pa.int32(), 'FirstName': pa.string(), 'LastName': pa.string(), 'HireDate': pa.timestamp('ms')},
+}
+
+# Low-cardinality names stored as categoricals (dictionary-encoded in Parquet)
+CATEGORY_COLUMNS = ['CountryName', 'CategoryName']
+
+# Sales columns read by the table builders
+SALES_COLUMNS = ['SalesID', 'SalesPersonID', 'CustomerID', 'ProductID', 'Quantity', 'Discount', 'TotalPrice', 'SalesDate']
+
+# Sales are streamed in blocks of this many bytes: peak memory is a few blocks
+# regardless of file size, and 256 MB amortises the per-chunk join/write overhead
+SALES_BLOCK_SIZE = 256 << 20
+
 # Ensure the output folder exists
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-def load_csv(file_name):
-    """ Load CSV file, trying both semicolon and comma delimiters """
+def detect_delimiter(file_path):
+    """ Pick semicolon or comma by inspecting the header line """
+    with open(file_path, newline='') as f:
+        header = f.readline(8192)
+    return ';' if header.count(';') > header.count(',') else ','
+
+def csv_options(file_name, columns=None):
+    """ Build the pyarrow parse and convert options shared by all readers """
+    file_path = os.path.join(DATA_FOLDER, file_name)
+    parse_options = pv.ParseOptions(delimiter=detect_delimiter(file_path))
+    convert_options = pv.ConvertOptions(
+        include_columns=columns,  # Only parse the columns the tables use
+        column_types=SCHEMAS.get(file_name, {}),
+        null_values=NULL_VALUES,
+        strings_can_be_null=True,
+    )
+    return parse_options, convert_options
+
+def load_csv(file_name, columns=None):
+    """ Load CSV file (optionally only some columns) with pyarrow, detecting semicolon or comma delimiters """
     file_path = os.path.join(DATA_FOLDER, file_name)
-    
+
     try:
-        df = pd.read_csv(file_path, sep=';', na_values=['NULL', 'NA', 'N/A', 'NaN', ''])
-        if df.shape[1] == 1:  # If only one column, try comma delimiter
-            df = pd.read_csv(file_path, sep=',', na_values=['NULL', 'NA', 'N/A', 'NaN', ''])
+        parse_options, convert_options = csv_options(file_name, columns)
+        table = pv.read_csv(file_path, parse_options=parse_options, convert_options=convert_options)
+        # Arrow-backed dtypes keep names as string[pyarrow] (offsets + UTF-8 buffer), not Python objects
+        df = table.to_pandas(types_mapper=pd.ArrowDtype, self_destruct=True)
+        for col in CATEGORY_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype('category')
     except Exception as e:
         print(f"❌ Error loading {file_name}: {e}")
         return None
@@ -23,120 +80,169 @@ def load_csv(file_name):
     print(f"✅ Loaded {file_name} with {df.shape[0]} rows and {df.shape[1]} columns")
     return df
 
-def save_csv(df, file_name):
-    """ Save DataFrame as CSV in the cleaned data folder """
-    output_path = os.path.join(OUTPUT_FOLDER, file_name)
-    df.to_csv(output_path, index=False)
-    print(f"💾 Saved cleaned data: {output_path}")
-
-# 🛠 Fix: **Recalculate TotalPrice after merging with Products**
-def recalculate_total_price(sales, products):
-    """ Merge sales with product prices and recalculate TotalPrice """
-    sales = sales.merge(products[['ProductID', 'Price']], on='ProductID', how='left')
+def load_csv_chunks(file_name, columns=None, block_size=SALES_BLOCK_SIZE):
+    """ Open CSV file as a stream of DataFrame chunks of roughly block_size bytes """
+    file_path = os.path.join(DATA_FOLDER, file_name)
 
-    # Fill missing prices with 0
-    sales['Price'] = sales['Price'].fillna(0)
+    try:
+        parse_options, convert_options = csv_options(file_name, columns)
+        reader = pv.open_csv(
+            file_path,
+            read_options=pv.ReadOptions(block_size=block_size),
+            parse_options=parse_options,
+            convert_options=convert_options,
+        )
+    except Exception as e:
+        print(f"❌ Error loading {file_name}: {e}")
+        return None
 
-    # Recalculate TotalPrice
-    mask = (sales['TotalPrice'].isna()) | (sales['TotalPrice'] == 0)
-    sales.loc[mask, 'TotalPrice'] = (sales.loc[mask, 'Price'] * sales.loc[mask, 'Quantity']) - sales.loc[mask, 'Discount']
+    print(f"✅ Streaming {file_name} with {len(reader.schema)} columns")
+    return (batch.to_pandas(types_mapper=pd.ArrowDtype) for batch in reader)
+
+def save_parquet(df, file_name, writers):
+    """ Append DataFrame chunk to a zstd-compressed Parquet file in the cleaned data folder, returning the written table """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    writer = writers.get(file_name)
+
+    if writer is None:
+        # Write to a temporary path; close_writers publishes it once every chunk succeeded
+        output_path = os.path.join(OUTPUT_FOLDER, file_name)
+        writer = writers[file_name] = pq.ParquetWriter(output_path + '.tmp', table.schema, compression='zstd')
+        print(f"💾 Saving cleaned data: {output_path}")
+    elif not table.schema.equals(writer.schema):
+        table = table.cast(writer.schema)
+
+    writer.write_table(table)
+    return table
+
+def close_writers(writers, publish=True):
+    """ Close every open Parquet writer, then publish its output or discard the partial file """
+    for file_name, writer in writers.items():
+        writer.close()
+        output_path = os.path.join(OUTPUT_FOLDER, file_name)
+        if publish:
+            os.replace(output_path + '.tmp', output_path)
+        else:
+            os.remove(output_path + '.tmp')
+    writers.clear()
+
+def build_price_lookup(products):
+    """ Map ProductID to Price for the per-chunk TotalPrice recalculation """
+    return dict(zip(products['ProductID'].values, products['Price'].values))
+
+# 🛠 Fix: **Recalculate TotalPrice from product prices**
+def recalculate_total_price(sales, prices):
+    """ Look up product prices and recalculate missing or zero TotalPrice """
+    # Missing prices count as 0
+    price = sales['ProductID'].map(prices).fillna(0).to_numpy(dtype='float64')
+    quantity = sales['Quantity'].to_numpy(dtype='float64', na_value=np.nan)
+    discount = sales['Discount'].to_numpy(dtype='float64', na_value=np.nan)
+    total = sales['TotalPrice'].to_numpy(dtype='float64', na_value=np.nan, copy=True)
+
+    # Recalculate TotalPrice in place, only where it is missing or zero
+    mask = np.isnan(total) | (total == 0)
+    np.subtract(price * quantity, discount, out=total, where=mask)
+    sales['TotalPrice'] = total
 
     return sales
 
+def to_day_offsets(dates):
+    """ Convert timestamps to int32 days since 1970-01-01, keeping missing values """
+    days = pa.array(dates).cast(pa.date32()).cast(pa.int32())
+    return pd.Series(days, index=dates.index, dtype=pd.ArrowDtype(pa.int32()))
+
 # 🛠 Module-Specific Tables
 
 ### **1️⃣ Customer Segmentation (RFM Analysis)**
-def create_rfm_table():
-    sales = load_csv("sales.csv")
-    customers = load_csv("customers.csv")
-    cities = load_csv("cities.csv")
-    countries = load_csv("countries.csv")
-    products = load_csv("products.csv")
-
-    if sales is None or customers is None or cities is None or countries is None or products is None:
-        return None
-
-    sales = recalculate_total_price(sales, products)
+def create_rfm_table(sales, writers):
+    # Segmentation only uses these columns; geography lives in the geographical sales table
+    # Recency only needs day granularity, so publish SalesDay (int32 days since 1970-01-01) instead of SalesDate
+    rfm = sales[['CustomerID', 'TotalPrice']].assign(SalesDay=to_day_offsets(sales['SalesDate']))
 
-    sales = sales.merge(customers[['CustomerID', 'CityID']], on='CustomerID', how='left')
-    sales = sales.merge(cities[['CityID', 'CountryID']], on='CityID', how='left')
-    sales = sales.merge(countries[['CountryID', 'CountryName']], on='CountryID', how='left')
-
-    save_csv(sales[['CustomerID', 'TotalPrice', 'SalesDate', 'CityID', 'CountryID', 'CountryName']], "cleaned_rfm_analysis.csv")
+    return save_parquet(rfm, "cleaned_rfm_analysis.parquet", writers)
 
 ### **2️⃣ Product Recommendations (Market Basket Analysis)**
-def create_product_recommendation_table():
-    sales = load_csv("sales.csv")
-    products = load_csv("products.csv")
-    categories = load_csv("categories.csv")
-
-    if sales is None or products is None or categories is None:
-        return None
-
-    sales = recalculate_total_price(sales, products)
+def create_product_recommendation_table(sales, products_ix, categories_ix, writers):
+    sales = sales.join(products_ix[['CategoryID']], on='ProductID', how='left')
+    sales = sales.join(categories_ix[['CategoryName']], on='CategoryID', how='left')
 
-    sales = sales.merge(products[['ProductID', 'CategoryID']], on='ProductID', how='left')
-    sales = sales.merge(categories[['CategoryID', 'CategoryName']], on='CategoryID', how='left')
-
-    save_csv(sales[['SalesID', 'CustomerID', 'ProductID', 'CategoryID', 'CategoryName', 'TotalPrice']], "cleaned_product_recommendations.csv")
+    save_parquet(sales[['SalesID', 'CustomerID', 'ProductID', 'CategoryID', 'CategoryName', 'TotalPrice']], "cleaned_product_recommendations.parquet", writers)
 
 ### **3️⃣ Sales Forecasting**
-def create_sales_forecasting_table():
-    sales = load_csv("sales.csv")
-    products = load_csv("products.csv")
-
-    if sales is None or products is None:
-        return None
-
-    sales = recalculate_total_price(sales, products)
-
-    save_csv(sales[['SalesID', 'SalesDate', 'TotalPrice', 'Quantity']], "cleaned_sales_forecasting.csv")
+def create_sales_forecasting_table(sales, writers):
+    save_parquet(sales[['SalesID', 'SalesDate', 'TotalPrice', 'Quantity']], "cleaned_sales_forecasting.parquet", writers)
 
 ### **4️⃣ Employee Performance Analysis**
-def create_employee_performance_table():
-    sales = load_csv("sales.csv")
-    employees = load_csv("employees.csv")
-    products = load_csv("products.csv")
-
-    if sales is None or employees is None or products is None:
-        return None
-
-    sales = recalculate_total_price(sales, products)
+def create_employee_performance_table(sales, employees_ix, writers):
+    sales = sales.join(employees_ix[['FirstName', 'LastName', 'HireDate']], on='SalesPersonID', how='left')
 
-    sales = sales.merge(employees[['EmployeeID', 'FirstName', 'LastName', 'HireDate']], left_on='SalesPersonID', right_on='EmployeeID', how='left')
-
-    save_csv(sales[['SalesID', 'SalesPersonID', 'FirstName', 'LastName', 'HireDate', 'TotalPrice']], "cleaned_employee_performance.csv")
+    save_parquet(sales[['SalesID', 'SalesPersonID', 'FirstName', 'LastName', 'HireDate', 'TotalPrice']], "cleaned_employee_performance.parquet", writers)
 
 ### **5️⃣ Geographical Sales Insights**
-def create_geographical_sales_table():
-    sales = load_csv("sales.csv")
-    customers = load_csv("customers.csv")
-    cities = load_csv("cities.csv")
-    countries = load_csv("countries.csv")
-    products = load_csv("products.csv")
-
-    if sales is None or customers is None or cities is None or countries is None or products is None:
-        return None
+def create_geographical_sales_table(sales, customers_ix, cities_ix, countries_ix, writers):
+    sales = sales.join(customers_ix[['CityID']], on='CustomerID', how='left')
+    sales = sales.join(cities_ix[['CountryID', 'CityName']], on='CityID', how='left')
+    sales = sales.join(countries_ix[['CountryName']], on='CountryID', how='left')
 
-    sales = recalculate_total_price(sales, products)
-
-    sales = sales.merge(customers[['CustomerID', 'CityID']], on='CustomerID', how='left')
-    sales = sales.merge(cities[['CityID', 'CountryID', 'CityName']], on='CityID', how='left')
-    sales = sales.merge(countries[['CountryID', 'CountryName']], on='CountryID', how='left')
-
-    save_csv(sales[['SalesID', 'SalesDate', 'TotalPrice', 'CustomerID', 'CityID', 'CityName', 'CountryID', 'CountryName']], "cleaned_geographical_sales.csv")
+    save_parquet(sales[['SalesID', 'SalesDate', 'TotalPrice', 'CustomerID', 'CityID', 'CityName', 'CountryID', 'CountryName']], "cleaned_geographical_sales.parquet", writers)
 
 ### **🚀 Run All Cleaning & Table Creation Functions**
 def main():
     print("\n🚀 Starting Data Preprocessing...\n")
 
-    create_rfm_table()  # Customer segmentation data
-    create_product_recommendation_table()  # Market basket analysis data
-    create_sales_forecasting_table()  # Sales forecasting data
-    create_employee_performance_table()  # Employee performance data
-    create_geographical_sales_table()  # Geographical sales analysis data
+    # Load each dimension table once, parsing only the columns the tables use
+    products = load_csv("products.csv", ['ProductID', 'Price', 'CategoryID'])
+    customers = load_csv("customers.csv", ['CustomerID', 'CityID'])
+    cities = load_csv("cities.csv", ['CityID', 'CountryID', 'CityName'])
+    countries = load_csv("countries.csv", ['CountryID', 'CountryName'])
+    categories = load_csv("categories.csv", ['CategoryID', 'CategoryName'])
+    employees = load_csv("employees.csv", ['EmployeeID', 'FirstName', 'LastName', 'HireDate'])
+    sales_chunks = load_csv_chunks("sales.csv", SALES_COLUMNS)
+
+    if any(df is None for df in (products, customers, cities, countries, categories, employees, sales_chunks)):
+        print("\n❌ Data preprocessing aborted: missing input data\n")
+        return
+
+    prices = build_price_lookup(products)
+
+    # Index the dimension tables by their keys once so every chunk joins against them
+    products_ix = products.set_index('ProductID')
+    customers_ix = customers.set_index('CustomerID')
+    cities_ix = cities.set_index('CityID')
+    countries_ix = countries.set_index('CountryID')
+    categories_ix = categories.set_index('CategoryID')
+    employees_ix = employees.set_index('EmployeeID')
+
+    writers = {}
+    rfm_tables = []
+    completed = False
+
+    # Parse and recalculate each sales chunk once, then feed it to every table
+    try:
+        for sales in sales_chunks:
+            sales = recalculate_total_price(sales, prices)
+
+            rfm_tables.append(create_rfm_table(sales, writers))  # Customer segmentation data
+            create_product_recommendation_table(sales, products_ix, categories_ix, writers)  # Market basket analysis data
+            create_sales_forecasting_table(sales, writers)  # Sales forecasting data
+            create_employee_performance_table(sales, employees_ix, writers)  # Employee performance data
+            create_geographical_sales_table(sales, customers_ix, cities_ix, countries_ix, writers)  # Geographical sales analysis data
+        completed = True
+    except pa.ArrowInvalid as e:
+        # Raised while parsing or converting a later sales block
+        print(f"❌ Error processing sales.csv: {e}")
+    finally:
+        close_writers(writers, publish=completed)
+
+    if not completed:
+        print("\n❌ Data preprocessing aborted: partial outputs discarded\n")
+        return
 
     print("\n✅ All module-specific datasets cleaned and saved successfully!\n")
 
+    # Hand the RFM rows to customer segmentation in memory instead of re-reading the Parquet file
+    if rfm_tables:
+        customer_segmentation.main(pa.concat_tables(rfm_tables).to_pandas())
+
 if __name__ == "__main__":
     main()